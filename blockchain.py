@@ -1,11 +1,46 @@
 from time import time
 from hashlib import sha256
-import json
+import orjson
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+import multiprocessing
+import threading
 from uuid import uuid4
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
 import requests
+from requests.adapters import HTTPAdapter
 from urllib.parse import urlparse
 
+try:
+	# C extension doing the nonce search with the SHA-NI (or else AVX2) instructions (see setup.py)
+	from pow_sha_ni import find_nonce
+except ImportError:
+	try:
+		# Not built or the CPU has neither SHA-NI nor AVX2, try the search compiled by Numba
+		from pow_numba import find_nonce
+	except ImportError:
+		# Neither is available, proof_of_work falls back to hashlib
+		find_nonce = None
+
+# Number of nodes whose connections are kept alive, resolve_conflicts() fetches at most this many chains at once
+# (with more threads than pools, the pools of the nodes would be evicted and reopened on every resolve)
+MAX_PEER_CONNECTIONS = 64
+
+# Shared by all the requests to the other nodes, so that their connections are kept alive and reused
+session = requests.Session()
+session.mount('http://', HTTPAdapter(
+	pool_connections=MAX_PEER_CONNECTIONS, pool_maxsize=MAX_PEER_CONNECTIONS, max_retries=1
+))
+
+# Raised while parsing or hashing a peer's chain which isn't well formed, e.g. struct.error for a
+# negative index or OverflowError for a negative proof in canonical_bytes(), the chain is then invalid
+MALFORMED_BLOCK_ERRORS = (KeyError, TypeError, ValueError, AttributeError, OverflowError, struct.error)
+
+# The keys of a block, all of them go into its hash (see canonical_bytes())
+BLOCK_FIELDS = {'index', 'timestamp', 'transactions', 'proof', 'previous_hash'}
+
 class Blockchain:
 	def __init__(self):
 		'''
@@ -13,9 +48,15 @@ class Blockchain:
 				current_transactions: List of the transactions to be mined in the next block
 							   chain: The actual blockchain list holding all the blocks
 							   nodes: Set of nodes (peers)
+								lock: Guards the above three, the app serves requests from several threads
+							verifier: Thread pool verifying the transactions of a block in parallel
+							  mining: Lets one proof_of_work() at a time start its search processes
 						 add_block(): Adds the genesis block with random previous_hash and proof
 						 			  (Thereby the genesis block won't verify but it would be same for all)
 		'''
+		self.lock = threading.RLock()
+		self.verifier = ThreadPoolExecutor(max_workers=os.cpu_count())
+		self.mining = threading.Lock()
 		self.current_transactions = []
 		self.chain = []
 		self.add_block(previous_hash='secret', proof=42)
@@ -29,34 +70,42 @@ class Blockchain:
 			Adds the participating node's URL to the blockchain nodes set
 		'''
 		parsed_url = urlparse(address)
-		if parsed_url.netloc:
-			self.nodes.add(parsed_url.netloc)
-		elif parsed_url.path:
-			self.nodes.add(parsed_url.path)
-		else:
-			raise ValueError('URL Invalid!')
-
-	def valid_chain(self, chain):
+		with self.lock:
+			if parsed_url.netloc:
+				self.nodes.add(parsed_url.netloc)
+			elif parsed_url.path:
+				self.nodes.add(parsed_url.path)
+			else:
+				raise ValueError('URL Invalid!')
+
+	def valid_chain(self, chain, start=1):
 		'''
 			Parameters -
 				chain: One of the chains to be validated for correctness
+				start: Index of the first block to be checked against the block before it (default = 1)
+					   The blocks before it are trusted, e.g. when they are already in this blockchain
+
+			The blocks are checked one after the other in this thread, hashlib keeps the GIL for
+			inputs as small as a block, so checking slices of the chain on other threads only adds overhead
 
 			Returns -
 				True if the chain is valid else False 
 		'''
-		last_block = chain[0]
-		current_index = 1
-		while current_index < len(chain):
-			block = chain[current_index]
-			last_block_hash = self.hash(last_block)
-			if block['previous_hash'] != last_block_hash:
-				return False
-
-			if not self.validate(last_block['proof'], block['proof'], last_block_hash):
+		# There is no block before start, e.g. in an empty chain which doesn't even have the genesis block
+		if start > len(chain):
+			return False
+
+		last_block = chain[start - 1]
+		last_block_hash = self.hash(last_block)
+		for block in islice(chain, start, None):
+			if block['previous_hash'] != last_block_hash or \
+					not self.validate(last_block['proof'], block['proof'], last_block_hash) or \
+					not self.verify_transactions(block['transactions']):
 				return False
 
+			# Carried over as the previous block (and its hash) of the next iteration
 			last_block = block
-			current_index += 1
+			last_block_hash = self.hash(block)
 
 		return True
 
@@ -68,27 +117,91 @@ class Blockchain:
 			Returns -
 				True if there was conflict which got resolved else False if there was no conflict at all
 		'''
-		neighbors = self.nodes
+		with self.lock:
+			neighbors = list(self.nodes)
 		new_chain = None
-		max_length = len(self.chain)
 
-		for node in neighbors:
-			url = f'http://{node}/chain'
-			response = requests.get(url)
+		# The requests are independent, so fetching them all at once only waits for the slowest node
+		# The lock isn't held meanwhile, the other requests are served while waiting on the nodes
+		with ThreadPoolExecutor(max_workers=min(max(len(neighbors), 1), MAX_PEER_CONNECTIONS)) as executor:
+			chains = list(executor.map(self.fetch_chain, neighbors))
+
+		with self.lock:
+			max_length = len(self.chain)
+			for chain in chains:
+				if chain is None or len(chain) <= max_length:
+					continue
+
+				try:
+					# Only the blocks after the ones shared with this blockchain need to be checked
+					common = self.common_prefix(chain)
+					valid = self.valid_chain(chain, start=max(common, 1))
+				except MALFORMED_BLOCK_ERRORS:
+					# A block the node sent is missing a field or holds one of the wrong type or range
+					continue
+
+				if valid:
+					max_length = len(chain)
+					new_chain = self.chain[:common] + chain[common:]
+
+			if new_chain:
+				self.chain = new_chain
+				return True
+
+		return False
 
-			if response.status_code == 200:
-				length = response.json()['length']
-				chain = response.json()['chain']
+	def common_prefix(self, chain):
+		'''
+			Parameters -
+				chain: The chain of another node
 
-				if length > max_length and self.valid_chain(chain):
-					max_length = length
-					new_chain = chain
+			Every block holds the hash of the block before it, so when the chains share a block
+			they share all the blocks before it as well, and the length is found by binary search
 
-		if new_chain:
-			self.chain = new_chain
-			return True
+			Returns -
+				The number of leading blocks the chain shares with this blockchain
+		'''
+		low, high = 0, min(len(self.chain), len(chain))
+		while low < high:
+			mid = (low + high + 1) // 2
+			if self.hash(self.chain[mid - 1]) == self.hash(chain[mid - 1]):
+				low = mid
+			else:
+				high = mid - 1
 
-		return False
+		return low
+
+	@staticmethod
+	def fetch_chain(node):
+		'''
+			Parameters -
+				node: Address of one of the participating nodes
+
+			Returns -
+				The chain of the node's blockchain else None if the node couldn't be reached
+				or didn't send a non empty chain of blocks with exactly the BLOCK_FIELDS keys
+		'''
+		try:
+			response = session.get(f'http://{node}/chain', timeout=2)
+		except requests.exceptions.RequestException:
+			return None
+
+		if response.status_code != 200:
+			return None
+
+		try:
+			chain = response.json()['chain']
+			# Never trust a memoized hash coming from a peer
+			for block in chain:
+				block.pop('_hash', None)
+				# Any other key isn't hashed, so it could hold anything without the chain turning invalid
+				if block.keys() != BLOCK_FIELDS:
+					return None
+		except MALFORMED_BLOCK_ERRORS:
+			return None
+
+		# The length the node claims isn't used, only the blocks it actually sent count
+		return chain or None
 
 	@property
 	def last_block(self):
@@ -102,13 +215,76 @@ class Blockchain:
 	def hash(block):
 		'''
 			Returns - 
-				The sha256 hash of the parameter block converted to json string
+				The sha256 hash of the parameter block's canonical bytes (see canonical_bytes())
+				(Memoized in the '_hash' key of the block)
+		'''
+		if block.get('_hash'):
+			return block['_hash']
+
+		block['_hash'] = sha256(Blockchain.canonical_bytes(block)).hexdigest()
+		return block['_hash']
+
+	@staticmethod
+	def canonical_bytes(block):
 		'''
-		block_string = json.dumps(block, sort_keys=True).encode()
-		# encode() converts to utf-8
-		# sort_keys to avoid inconsistencies, since in dict the order doesn't matter, but here we need order
-		
-		return sha256(block_string).hexdigest()
+			Returns -
+				The fixed layout bytes of the block which are hashed, all big endian -
+					index (8 bytes) | timestamp (8 byte double) | merkle root of the transactions (32 bytes)
+					| proof (2 byte length + bytes) | previous_hash (2 byte length + utf-8 bytes)
+				Only the transactions are serialized (to json), as the leaves of merkle_root()
+		'''
+		proof = block['proof'].to_bytes((block['proof'].bit_length() + 7) // 8, 'big')
+		previous_hash = block['previous_hash'].encode()
+
+		return struct.pack(
+			f'>Qd32sH{len(proof)}sH{len(previous_hash)}s',
+			block['index'],
+			block['timestamp'],
+			Blockchain.merkle_root(block['transactions']),
+			len(proof), proof,
+			len(previous_hash), previous_hash
+		)
+
+	@staticmethod
+	def merkle_root(transactions):
+		'''
+			Parameters -
+				transactions: List of the transactions of a block
+
+			The leaves are the sha256 hashes of the transactions converted to json bytes (by orjson)
+			Each level hashes the concatenated pairs of the level below, the odd one out is carried up unchanged
+			(Pairing it with itself would give [a, b, c] and [a, b, c, c] the same root)
+
+			Returns -
+				The 32 byte merkle root of the transactions (all zeros when there are none)
+		'''
+		# OPT_SORT_KEYS to avoid inconsistencies, since in dict the order doesn't matter, but here we need order
+		# orjson returns utf-8 bytes directly, no encode() needed
+		level = [sha256(orjson.dumps(tx, option=orjson.OPT_SORT_KEYS)).digest() for tx in transactions]
+		if not level:
+			return bytes(32)
+
+		while len(level) > 1:
+			odd = level[-1:] if len(level) % 2 else []
+			level = [sha256(level[i] + level[i + 1]).digest() for i in range(0, len(level) - 1, 2)] + odd
+
+		return level[0]
+
+	@staticmethod
+	def export_chain(chain):
+		'''
+			Returns -
+				Copy of the chain without the memoized '_hash' of the blocks, as shown to the users and peers
+		'''
+		return [Blockchain.export_block(block) for block in chain]
+
+	@staticmethod
+	def export_block(block):
+		'''
+			Returns -
+				Copy of the block without its memoized '_hash', as shown to the users and peers
+		'''
+		return {k: v for k, v in block.items() if k != '_hash'}
 
 	def new_transaction(self, sender, recipient, amount):
 		'''
@@ -118,6 +294,8 @@ class Blockchain:
 				   amount: The amount of coins to be transferred from sender to recipient
 
 			Adds a new transaction to the current_transactions pool
+			Raises ValueError if the transaction doesn't verify or can't be serialized by orjson
+			(e.g. an amount of 2 ** 64 or more, the block holding it could never be hashed or sent)
 
 			Returns -
 				The index of the block where this particular transaction would be added 
@@ -128,15 +306,54 @@ class Blockchain:
 			'recipient':recipient, 
 			'amount':amount 
 		}
-		self.current_transactions.append(tx)
+		try:
+			orjson.dumps(tx)
+		except orjson.JSONEncodeError:
+			raise ValueError('Transaction Invalid!')
+
+		if not self.verify_transaction(tx):
+			raise ValueError('Transaction Invalid!')
 
-		return self.last_block['index'] + 1
+		with self.lock:
+			self.current_transactions.append(tx)
+
+			return self.last_block['index'] + 1
+
+	def verify_transactions(self, transactions):
+		'''
+			Parameters -
+				transactions: List of the transactions of a block
+
+			The transactions are independent of each other, so they are verified in parallel on the
+			verifier thread pool (signature checks such as coincurve's release the GIL while they run)
+
+			Returns -
+				True if all the transactions are valid else False
+		'''
+		if len(transactions) <= 1:
+			return all(map(self.verify_transaction, transactions))
+
+		return all(self.verifier.map(self.verify_transaction, transactions))
+
+	@staticmethod
+	def verify_transaction(tx):
+		'''
+			Parameters -
+				tx: One of the transactions
+
+			Placeholder for the signature check of the sender, the transactions aren't signed yet
+
+			Returns -
+				True if the transaction is valid else False
+		'''
+		return True
 
 	def add_block(self, proof, previous_hash):
 		'''
 			Parameters -
 						proof: Proof (Nonce) obtained from the Proof of Work algorithm for the current block
 				previous_hash: Hash of the previous block which is the latest block in the blockchain for now
+							   (Always given by the caller, who has it at hand already - 'secret' for the genesis block)
 
 			Includes all the transactions from the transaction pool in the current block
 			Clears the transaction pool
@@ -145,15 +362,17 @@ class Blockchain:
 			Returns -
 				The newly created (mined) block
 		'''
-		block = {
-			'index': len(self.chain) + 1,
-			'timestamp': time(),
-			'transactions': self.current_transactions,
-			'proof': proof,
-			'previous_hash': previous_hash or self.hash(self.chain[-1])
-		}
-		self.current_transactions = []
-		self.chain.append(block)
+		with self.lock:
+			block = {
+				'index': len(self.chain) + 1,
+				'timestamp': time(),
+				'transactions': self.current_transactions,
+				'proof': proof,
+				'previous_hash': previous_hash,
+				'_hash': None
+			}
+			self.current_transactions = []
+			self.chain.append(block)
 
 		return block
 
@@ -172,28 +391,122 @@ class Blockchain:
 				True if the obtained hash begins with the difficulty number of zeros else False
 		'''
 		guess = f'{last_proof}{proof}{last_hash}'.encode()
-		guess_hash = sha256(guess).hexdigest()
 
-		return guess_hash[:difficulty] == '0' * difficulty
+		# Compares the raw digest against the bound instead of building and slicing the hex string
+		return sha256(guess).digest() < Blockchain.target(difficulty)
+
+	@staticmethod
+	def target(difficulty):
+		'''
+			Parameters -
+				difficulty: The number of zeros needed in a hash to agree upon the proof of work
+
+			Returns -
+				The bound which a raw sha256 digest is less than (as bytes) exactly when its hex
+				form begins with the difficulty number of zeros, i.e. 2 ** (256 - 4 * difficulty)
+		'''
+		if difficulty <= 0:
+			return b'\xff' * 33
+		if difficulty > 64:
+			return b''
+
+		return (1 << (256 - 4 * difficulty)).to_bytes(32, 'big')
 
-	def proof_of_work(self, last_block):
+	def proof_of_work(self, last_block, difficulty=4):
 		'''
 			Parameters -
 				last_block: The current block in the blockchain
+				difficulty: The number of zeros needed in a hash to agree upon the proof of work (default = 4)
 
 			Extracts the proof and hash from the last_block
 			Finds the proof (nonce) which validates (as per the above function)
+			The search runs in the pow_sha_ni extension (or else pow_numba) when available,
+			else it is split across one search_nonces() process per CPU core
+			The processes are started by a forkserver (or spawned), not forked from this process,
+			whose other threads (serving requests, verifying transactions) may hold locks meanwhile
 
 			Returns -
 				The proof (nonce) obtained for the block
 		'''
 		last_proof = last_block['proof']
 		last_hash = self.hash(last_block)
-		proof = 0
-		while not (self.validate(last_proof, proof, last_hash)):
-			proof += 1
+		if find_nonce is not None:
+			return find_nonce(f'{last_proof}'.encode(), last_hash.encode(), difficulty)
+
+		workers = os.cpu_count() or 1
+		if workers == 1:
+			return self.search_nonces(0, 1, last_proof, last_hash, difficulty)
+
+		methods = multiprocessing.get_all_start_methods()
+		context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+		found = context.Value('q', -1)
+		# Worker i tries the proofs i, i + workers, i + 2 * workers, ... until any worker finds one
+		processes = [
+			context.Process(target=Blockchain.search_nonces, args=(i, workers, last_proof, last_hash, difficulty, found))
+			for i in range(workers)
+		]
+		# Every search already takes all the cores, concurrent /mine requests wait for it instead
+		with self.mining:
+			for process in processes:
+				process.start()
+			for process in processes:
+				process.join()
+
+		# No proof was published if all the workers died (e.g. killed by a signal), search here instead
+		if found.value < 0:
+			return self.search_nonces(0, 1, last_proof, last_hash, difficulty)
+
+		return found.value
 
-		return proof
+	@staticmethod
+	def search_nonces(start, stride, last_proof, last_hash, difficulty=4, found=None):
+		'''
+			Parameters -
+					 start: The first proof (nonce) to be tried
+					stride: The step between two consecutive proofs to be tried
+				last_proof: Proof (nonce) of the previous block
+				 last_hash: Hash of the previous block
+				difficulty: The number of zeros needed in a hash to agree upon the proof of work (default = 4)
+					 found: Shared multiprocessing.Value('q') where the proof is published (-1 until then)
+							The search stops once any worker has published a proof
+
+			Returns -
+				The first proof (nonce) from start which validates, None if another worker found one first
+		'''
+		# Same hash as validate(), but no string is formatted per proof -
+		# all the leading digits of a proof but the last three are hashed once per 1000 proofs after last_proof,
+		# and the last three digits with last_hash come ready made from a table
+		prefix = f'{last_proof}'.encode()
+		suffix = last_hash.encode()
+		tails = [b'%03d' % low + suffix for low in range(1000)]
+		# Proofs below 1000 aren't zero padded
+		first_tails = [b'%d' % low + suffix for low in range(1000)]
+		target = Blockchain.target(difficulty)
+
+		proof = start
+		# Only look at the shared value once per 1000 proofs, reading it takes its lock
+		while found is None or found.value < 0:
+			high, low = divmod(proof, 1000)
+			if high:
+				midstate = sha256(prefix + b'%d' % high)
+				group_tails = tails
+			else:
+				midstate = sha256(prefix)
+				group_tails = first_tails
+
+			for low in range(low, 1000, stride):
+				guess = midstate.copy()
+				guess.update(group_tails[low])
+				if guess.digest() < target:
+					proof = high * 1000 + low
+					if found is not None:
+						with found.get_lock():
+							if found.value < 0:
+								found.value = proof
+					return proof
+			proof = high * 1000 + low + stride
+
+		return None
 
 # Initialize the Flask app
 app = Flask(__name__)
@@ -209,12 +522,19 @@ blockchain = Blockchain()
 def full_chain():
 	'''
 		Displays the full blockchain in JSON format 
+		The blocks are serialized one at a time while the response is being sent,
+		so the JSON of the whole chain is never held in memory at once
 	'''
-	response = {
-		'chain': blockchain.chain,
-		'length': len(blockchain.chain)
-	}
-	return jsonify(response), 200  # 200 implies a good request
+	with blockchain.lock:
+		chain = list(blockchain.chain)
+
+	def generate():
+		yield b'{"length":%d,"chain":[' % len(chain)
+		for i, block in enumerate(chain):
+			yield (b',' if i else b'') + orjson.dumps(blockchain.export_block(block))
+		yield b']}'
+
+	return Response(generate(), mimetype='application/json'), 200  # 200 implies a good request
 
 @app.route('/transactions/new', methods=['POST'])
 def new_transaction():
@@ -231,7 +551,11 @@ def new_transaction():
 	recipient = values['recipient']
 	amount = values['amount']
 
-	index = blockchain.new_transaction(sender, recipient, amount)
+	try:
+		index = blockchain.new_transaction(sender, recipient, amount)
+	except ValueError:
+		return 'Invalid transaction', 400
+
 	response = {
 		'message': f'Block #{index}'
 	}
@@ -242,12 +566,21 @@ def mine():
 	'''
 		Mines a new block with the same sender, recipient and amount always
 	'''
-	last_block = blockchain.last_block
-	proof = blockchain.proof_of_work(last_block)
-
-	blockchain.new_transaction('0', node_identifier, 20)
-	previous_hash = blockchain.hash(last_block)
-	block = blockchain.add_block(proof, previous_hash)
+	while True:
+		# The lock isn't held during the proof of work (the find_nonce search releases the GIL too),
+		# so /chain and /transactions/new are still served while mining
+		last_block = blockchain.last_block
+		proof = blockchain.proof_of_work(last_block)
+
+		with blockchain.lock:
+			# The proof is only good for last_block, start over if a block was added meanwhile
+			if blockchain.last_block is not last_block:
+				continue
+
+			blockchain.new_transaction('0', node_identifier, 20)
+			previous_hash = blockchain.hash(last_block)
+			block = blockchain.add_block(proof, previous_hash)
+			break
 
 	response = {
 		'message': 'New block was mined!',
@@ -257,22 +590,24 @@ def mine():
 		'previous_hash': block['previous_hash']
 	}
 
-	return jsonify(response), 200
+	return app.response_class(orjson.dumps(response), mimetype='application/json'), 200
 
 @app.route('/nodes/register', methods=['POST'])
 def register_nodes():
 	'''
 		Registers the nodes to the set of nodes for a blockchain
 	'''
-	values = json.loads(requests.data)
+	values = request.get_json(force=True)
 	nodes = values.get('nodes')
 	if nodes is None:
 		return 'Error', 400
 	for node in nodes:
-		blockchain.register_node('http://1227.0.0.1:' + str(node))
+		blockchain.register_node('http://127.0.0.1:' + str(node))
+	with blockchain.lock:
+		node_list = list(blockchain.nodes)
 	response = {
 		'message': 'Added new nodes',
-		'node_list': list(blockchain.nodes)
+		'node_list': node_list
 	}
 	return jsonify(response), 200
 
@@ -285,7 +620,7 @@ def consensus():
 	if replaced:
 		response = {
 			'message': 'Blockchain was replaced!',
-			'new_chain': blockchain.chain
+			'new_chain': blockchain.export_chain(blockchain.chain)
 		}
 	else:
 		response = {
@@ -305,4 +640,8 @@ if __name__ == '__main__':
 	port = parser.parse_args().port
 
 	# Run the app on the localhost and on the specified port in debug mode
-	app.run(host='127.0.0.1', port=port, debug=True)
\ No newline at end of file
+	# threaded so that /chain and /transactions/new don't wait behind a /mine
+	# Outside of development run one worker with threads instead, e.g.
+	# 	gunicorn -w 1 -k gthread --threads 8 --bind 127.0.0.1:5000 blockchain:app
+	# (one worker since each process holds its own blockchain)
+	app.run(host='127.0.0.1', port=port, debug=True, threaded=True)
\ No newline at end of file
@@ -0,0 +1,199 @@
+'''
+	Proof of Work nonce search compiled by Numba, used when the pow_sha_ni extension isn't built
+
+	Same contract as pow_sha_ni.find_nonce() - the smallest nonce for which
+	sha256(prefix + str(nonce) + suffix) begins with difficulty hex zeros
+'''
+import numpy as np
+from numba import njit, prange, get_num_threads, uint32
+
+# Nonces tried by each thread before the threads compare their results
+CHUNK = 4096
+
+K = np.array([
+	0x428a2f98, 0x71374491, 0xb5c0fbcf, 0xe9b5dba5, 0x3956c25b, 0x59f111f1, 0x923f82a4, 0xab1c5ed5,
+	0xd807aa98, 0x12835b01, 0x243185be, 0x550c7dc3, 0x72be5d74, 0x80deb1fe, 0x9bdc06a7, 0xc19bf174,
+	0xe49b69c1, 0xefbe4786, 0x0fc19dc6, 0x240ca1cc, 0x2de92c6f, 0x4a7484aa, 0x5cb0a9dc, 0x76f988da,
+	0x983e5152, 0xa831c66d, 0xb00327c8, 0xbf597fc7, 0xc6e00bf3, 0xd5a79147, 0x06ca6351, 0x14292967,
+	0x27b70a85, 0x2e1b2138, 0x4d2c6dfc, 0x53380d13, 0x650a7354, 0x766a0abb, 0x81c2c92e, 0x92722c85,
+	0xa2bfe8a1, 0xa81a664b, 0xc24b8b70, 0xc76c51a3, 0xd192e819, 0xd6990624, 0xf40e3585, 0x106aa070,
+	0x19a4c116, 0x1e376c08, 0x2748774c, 0x34b0bcb5, 0x391c0cb3, 0x4ed8aa4a, 0x5b9cca4f, 0x682e6ff3,
+	0x748f82ee, 0x78a5636f, 0x84c87814, 0x8cc70208, 0x90befffa, 0xa4506ceb, 0xbef9a3f7, 0xc67178f2
+], dtype=np.uint32)
+
+IV = np.array([
+	0x6a09e667, 0xbb67ae85, 0x3c6ef372, 0xa54ff53a, 0x510e527f, 0x9b05688c, 0x1f83d9ab, 0x5be0cd19
+], dtype=np.uint32)
+
+@njit(cache=True, inline='always')
+def _ror(x, n):
+	'''
+		Returns -
+			The 32 bit word x rotated right by n bits
+	'''
+	return uint32((x >> uint32(n)) | (x << uint32(32 - n)))
+
+@njit(cache=True)
+def _sha256_block(state, msg, offset, w):
+	'''
+		Parameters -
+			state: The 8 words of the hash so far (updated in place)
+			  msg: The padded message
+		   offset: Offset of the 64 byte block of msg to be compressed
+				w: Scratch space for the 64 words of the message schedule
+
+		Every intermediate is cast back to uint32, otherwise Numba widens the words to 64 bits
+	'''
+	for t in range(16):
+		i = offset + 4 * t
+		w[t] = (uint32(msg[i]) << uint32(24)) | (uint32(msg[i + 1]) << uint32(16)) | \
+			(uint32(msg[i + 2]) << uint32(8)) | uint32(msg[i + 3])
+	for t in range(16, 64):
+		s0 = _ror(w[t - 15], 7) ^ _ror(w[t - 15], 18) ^ (w[t - 15] >> uint32(3))
+		s1 = _ror(w[t - 2], 17) ^ _ror(w[t - 2], 19) ^ (w[t - 2] >> uint32(10))
+		w[t] = uint32(w[t - 16] + s0 + w[t - 7] + s1)
+
+	a, b, c, d, e, f, g, h = state[0], state[1], state[2], state[3], state[4], state[5], state[6], state[7]
+	for t in range(64):
+		t1 = uint32(h + (_ror(e, 6) ^ _ror(e, 11) ^ _ror(e, 25)) + ((e & f) ^ (~e & g)) + K[t] + w[t])
+		t2 = uint32((_ror(a, 2) ^ _ror(a, 13) ^ _ror(a, 22)) + ((a & b) ^ (a & c) ^ (b & c)))
+		h, g, f, e, d, c, b, a = g, f, e, uint32(d + t1), c, b, a, uint32(t1 + t2)
+
+	state[0] += a
+	state[1] += b
+	state[2] += c
+	state[3] += d
+	state[4] += e
+	state[5] += f
+	state[6] += g
+	state[7] += h
+
+@njit(cache=True)
+def _build_message(msg, prefix, nonce, suffix):
+	'''
+		Lays out prefix || nonce (as decimal digits) || suffix in msg followed by the SHA-256 padding
+
+		Returns -
+			The number of 64 byte blocks in the message
+	'''
+	length = len(prefix)
+	msg[:length] = prefix
+
+	digits = 1
+	rest = nonce // 10
+	while rest:
+		digits += 1
+		rest //= 10
+	rest = nonce
+	for i in range(digits - 1, -1, -1):
+		msg[length + i] = 48 + rest % 10
+		rest //= 10
+	length += digits
+
+	msg[length:length + len(suffix)] = suffix
+	length += len(suffix)
+
+	nblocks = (length + 9 + 63) // 64
+	msg[length] = 0x80
+	msg[length + 1:nblocks * 64] = 0
+	bits = length * 8
+	for i in range(8):
+		msg[nblocks * 64 - 1 - i] = (bits >> (8 * i)) & 0xff
+
+	return nblocks
+
+@njit(cache=True)
+def _increment_digits(msg, start, digits):
+	'''
+		Increments the decimal nonce of digits digits at msg[start:] in place
+
+		Returns -
+			False if the nonce needs one more digit (all the digits were 9) else True
+	'''
+	for i in range(start + digits - 1, start - 1, -1):
+		if msg[i] != 57:
+			msg[i] += 1
+			return True
+		msg[i] = 48
+
+	return False
+
+@njit(cache=True)
+def _has_leading_zeros(state, difficulty):
+	'''
+		Returns -
+			True if the hash words begin with difficulty zero nibbles else False
+	'''
+	i = 0
+	while difficulty >= 8:
+		if state[i]:
+			return False
+		i += 1
+		difficulty -= 8
+
+	return difficulty == 0 or (state[i] >> uint32(32 - 4 * difficulty)) == 0
+
+@njit(cache=True, parallel=True)
+def _search(prefix, suffix, difficulty, base, threads):
+	'''
+		Parameters -
+				prefix, suffix: The bytes around the nonce as uint8 arrays
+					difficulty: The number of leading hex zeros needed in the hash
+						  base: The first nonce of this round
+					   threads: Thread t tries the CHUNK nonces from base + t * CHUNK
+
+		Returns -
+			The smallest nonce of the round satisfying the difficulty else -1
+	'''
+	found = np.full(threads, -1, dtype=np.int64)
+	for t in prange(threads):
+		msg = np.empty(len(prefix) + 20 + len(suffix) + 72, dtype=np.uint8)
+		state = np.empty(8, dtype=np.uint32)
+		w = np.empty(64, dtype=np.uint32)
+		first = base + t * CHUNK
+		nblocks = _build_message(msg, prefix, first, suffix)
+		digits = len(str(first))
+		for nonce in range(first, first + CHUNK):
+			# Only the digits change from one nonce to the next, unless the nonce gains a digit
+			if nonce > first and not _increment_digits(msg, len(prefix), digits):
+				nblocks = _build_message(msg, prefix, nonce, suffix)
+				digits += 1
+
+			state[:] = IV
+			for block in range(nblocks):
+				_sha256_block(state, msg, 64 * block, w)
+			if _has_leading_zeros(state, difficulty):
+				found[t] = nonce
+				break
+
+	# The ranges of the threads are in order, so the first hit is the smallest nonce
+	for t in range(threads):
+		if found[t] >= 0:
+			return found[t]
+
+	return -1
+
+def find_nonce(prefix, suffix, difficulty):
+	'''
+		Parameters -
+				prefix: Bytes placed before the nonce (the proof of the previous block)
+				suffix: Bytes placed after the nonce (the hash of the previous block)
+			difficulty: The number of leading hex zeros needed in the hash
+
+		Searches the nonces in rounds of CHUNK nonces per thread, on all the threads of Numba
+
+		Returns -
+			The smallest nonce for which sha256(prefix + str(nonce) + suffix) begins with difficulty hex zeros
+	'''
+	if difficulty > 64:
+		raise ValueError('difficulty can be at most 64 hex digits')
+
+	prefix = np.frombuffer(prefix, dtype=np.uint8)
+	suffix = np.frombuffer(suffix, dtype=np.uint8)
+	threads = get_num_threads()
+	base = 0
+	while True:
+		nonce = _search(prefix, suffix, difficulty, base, threads)
+		if nonce >= 0:
+			return int(nonce)
+		base += threads * CHUNK
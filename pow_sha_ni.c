@@ -0,0 +1,611 @@
+/*
+	Proof of Work nonce search using the Intel SHA extensions
+
+	Finds the smallest nonce for which sha256(prefix || nonce || suffix) begins with
+	difficulty hex zeros, exactly like Blockchain.validate() does in Python, but with the
+	SHA-256 block compression running on the SHA-NI instructions
+	CPUs without SHA-NI but with AVX2 hash eight nonces at once, one per 32 bit lane
+
+	Build in place with -
+		python setup.py build_ext --inplace
+*/
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include <stdint.h>
+#include <stdlib.h>
+#include <string.h>
+
+#if defined(__x86_64__) || defined(__i386__)
+#include <immintrin.h>
+#define POW_X86 1
+#endif
+
+#define NONCE_MAX_DIGITS 20
+
+#ifdef POW_X86
+
+static const uint32_t K[64] = {
+	0x428a2f98, 0x71374491, 0xb5c0fbcf, 0xe9b5dba5, 0x3956c25b, 0x59f111f1, 0x923f82a4, 0xab1c5ed5,
+	0xd807aa98, 0x12835b01, 0x243185be, 0x550c7dc3, 0x72be5d74, 0x80deb1fe, 0x9bdc06a7, 0xc19bf174,
+	0xe49b69c1, 0xefbe4786, 0x0fc19dc6, 0x240ca1cc, 0x2de92c6f, 0x4a7484aa, 0x5cb0a9dc, 0x76f988da,
+	0x983e5152, 0xa831c66d, 0xb00327c8, 0xbf597fc7, 0xc6e00bf3, 0xd5a79147, 0x06ca6351, 0x14292967,
+	0x27b70a85, 0x2e1b2138, 0x4d2c6dfc, 0x53380d13, 0x650a7354, 0x766a0abb, 0x81c2c92e, 0x92722c85,
+	0xa2bfe8a1, 0xa81a664b, 0xc24b8b70, 0xc76c51a3, 0xd192e819, 0xd6990624, 0xf40e3585, 0x106aa070,
+	0x19a4c116, 0x1e376c08, 0x2748774c, 0x34b0bcb5, 0x391c0cb3, 0x4ed8aa4a, 0x5b9cca4f, 0x682e6ff3,
+	0x748f82ee, 0x78a5636f, 0x84c87814, 0x8cc70208, 0x90befffa, 0xa4506ceb, 0xbef9a3f7, 0xc67178f2
+};
+
+static const uint32_t IV[8] = {
+	0x6a09e667, 0xbb67ae85, 0x3c6ef372, 0xa54ff53a, 0x510e527f, 0x9b05688c, 0x1f83d9ab, 0x5be0cd19
+};
+
+/*
+	The constant parts of the message around the nonce
+	Whole 64 byte blocks at the start of the prefix are hashed once into midstate,
+	so every nonce only hashes the blocks from the one holding the nonce onwards
+*/
+typedef struct {
+	const char *prefix;		/* Tail of the prefix which didn't fill a whole block */
+	size_t prefix_len;
+	const char *suffix;
+	size_t suffix_len;
+	size_t absorbed;		/* Prefix bytes already hashed into midstate */
+	uint32_t midstate[8];
+} layout;
+
+/*
+	Writes the decimal digits of nonce to out
+	Returns the number of digits written
+*/
+static size_t format_nonce(uint64_t nonce, char *out)
+{
+	char digits[NONCE_MAX_DIGITS];
+	size_t len = 0;
+
+	do {
+		digits[len++] = (char)('0' + nonce % 10);
+		nonce /= 10;
+	} while (nonce);
+
+	for (size_t i = 0; i < len; i++)
+		out[i] = digits[len - 1 - i];
+
+	return len;
+}
+
+/*
+	Increments the ASCII decimal number in place
+	Returns 0 if the number needs one more digit (all the digits were 9) else 1
+*/
+static int increment_digits(char *digits, size_t len)
+{
+	while (len--) {
+		if (digits[len] != '9') {
+			digits[len]++;
+			return 1;
+		}
+		digits[len] = '0';
+	}
+	return 0;
+}
+
+/*
+	Lays out the prefix tail || nonce || suffix in msg followed by the SHA-256 padding
+	Returns the number of 64 byte blocks to hash after the midstate
+*/
+static size_t build_message(unsigned char *msg, const layout *l, uint64_t nonce)
+{
+	size_t len = l->prefix_len;
+	size_t nblocks;
+	uint64_t bits;
+
+	memcpy(msg, l->prefix, l->prefix_len);
+	len += format_nonce(nonce, (char *)msg + len);
+	memcpy(msg + len, l->suffix, l->suffix_len);
+	len += l->suffix_len;
+
+	nblocks = (len + 9 + 63) / 64;
+	bits = (uint64_t)(l->absorbed + len) * 8;
+	msg[len] = 0x80;
+	memset(msg + len + 1, 0, nblocks * 64 - len - 1);
+	for (int i = 0; i < 8; i++)
+		msg[nblocks * 64 - 1 - i] = (unsigned char)(bits >> (8 * i));
+
+	return nblocks;
+}
+
+/*
+	Returns 1 if the digest words begin with difficulty zero nibbles else 0
+*/
+static int has_leading_zeros(const uint32_t h[8], unsigned difficulty)
+{
+	unsigned i;
+
+	for (i = 0; difficulty >= 8; i++, difficulty -= 8)
+		if (h[i])
+			return 0;
+
+	return difficulty == 0 || (h[i] >> (32 - 4 * difficulty)) == 0;
+}
+
+#define ROR32(x, n) (((x) >> (n)) | ((x) << (32 - (n))))
+
+/*
+	Portable SHA-256 compression over nblocks 64 byte blocks of data, updating state in place
+	Only used for the odd group of nonces whose messages differ in length
+*/
+static void sha256_blocks(uint32_t state[8], const unsigned char *data, size_t nblocks)
+{
+	uint32_t w[64], v[8], t1, t2;
+
+	for (; nblocks; nblocks--, data += 64) {
+		for (int t = 0; t < 16; t++)
+			w[t] = (uint32_t)data[4 * t] << 24 | (uint32_t)data[4 * t + 1] << 16 |
+				   (uint32_t)data[4 * t + 2] << 8 | (uint32_t)data[4 * t + 3];
+		for (int t = 16; t < 64; t++)
+			w[t] = (ROR32(w[t - 2], 17) ^ ROR32(w[t - 2], 19) ^ (w[t - 2] >> 10)) + w[t - 7] +
+				   (ROR32(w[t - 15], 7) ^ ROR32(w[t - 15], 18) ^ (w[t - 15] >> 3)) + w[t - 16];
+
+		memcpy(v, state, sizeof(v));
+		for (int t = 0; t < 64; t++) {
+			t1 = v[7] + (ROR32(v[4], 6) ^ ROR32(v[4], 11) ^ ROR32(v[4], 25)) +
+				 ((v[4] & v[5]) ^ (~v[4] & v[6])) + K[t] + w[t];
+			t2 = (ROR32(v[0], 2) ^ ROR32(v[0], 13) ^ ROR32(v[0], 22)) +
+				 ((v[0] & v[1]) ^ (v[0] & v[2]) ^ (v[1] & v[2]));
+			memmove(v + 1, v, 7 * sizeof(uint32_t));
+			v[4] += t1;
+			v[0] = t1 + t2;
+		}
+
+		for (int i = 0; i < 8; i++)
+			state[i] += v[i];
+	}
+}
+
+/*
+	Hashes the whole blocks at the start of prefix into the midstate of l
+*/
+static void layout_init(layout *l, const char *prefix, size_t prefix_len, const char *suffix, size_t suffix_len)
+{
+	l->absorbed = prefix_len - prefix_len % 64;
+	l->prefix = prefix + l->absorbed;
+	l->prefix_len = prefix_len - l->absorbed;
+	l->suffix = suffix;
+	l->suffix_len = suffix_len;
+	memcpy(l->midstate, IV, sizeof(IV));
+	sha256_blocks(l->midstate, (const unsigned char *)prefix, l->absorbed / 64);
+}
+
+/*
+	Converts state (H0..H7) to the ABEF/CDGH register layout used by sha256rnds2
+*/
+__attribute__((target("sha,sse4.1")))
+static inline void load_state(const uint32_t state[8], __m128i *abef, __m128i *cdgh)
+{
+	__m128i tmp = _mm_shuffle_epi32(_mm_loadu_si128((const __m128i *)&state[0]), 0xb1);
+	__m128i efgh = _mm_shuffle_epi32(_mm_loadu_si128((const __m128i *)&state[4]), 0x1b);
+
+	*abef = _mm_alignr_epi8(tmp, efgh, 8);
+	*cdgh = _mm_blend_epi16(efgh, tmp, 0xf0);
+}
+
+/*
+	Converts the ABEF/CDGH register layout back to state (H0..H7)
+*/
+__attribute__((target("sha,sse4.1")))
+static inline void store_state(uint32_t state[8], __m128i abef, __m128i cdgh)
+{
+	__m128i tmp = _mm_shuffle_epi32(abef, 0x1b);
+
+	cdgh = _mm_shuffle_epi32(cdgh, 0xb1);
+	_mm_storeu_si128((__m128i *)&state[0], _mm_blend_epi16(tmp, cdgh, 0xf0));
+	_mm_storeu_si128((__m128i *)&state[4], _mm_alignr_epi8(cdgh, tmp, 8));
+}
+
+/*
+	Runs the SHA-256 compression over nblocks 64 byte blocks of data, updating state in place
+*/
+__attribute__((target("sha,sse4.1")))
+static void sha256_ni_blocks(uint32_t state[8], const unsigned char *data, size_t nblocks)
+{
+	const __m128i mask = _mm_set_epi64x(0x0c0d0e0f08090a0bULL, 0x0405060700010203ULL);
+	__m128i state0, state1, msg, tmp, abef, cdgh;
+	__m128i w[4];
+
+	load_state(state, &state0, &state1);
+
+	for (; nblocks; nblocks--, data += 64) {
+		abef = state0;
+		cdgh = state1;
+
+		for (int i = 0; i < 4; i++)
+			w[i] = _mm_shuffle_epi8(_mm_loadu_si128((const __m128i *)(data + 16 * i)), mask);
+
+		/* Four rounds per step, w[] holds the last four message schedule quads */
+#pragma GCC unroll 16
+		for (int i = 0; i < 16; i++) {
+			msg = _mm_add_epi32(w[i & 3], _mm_loadu_si128((const __m128i *)&K[4 * i]));
+			state1 = _mm_sha256rnds2_epu32(state1, state0, msg);
+			if (i >= 3 && i < 15) {
+				tmp = _mm_sha256msg1_epu32(w[(i + 1) & 3], w[(i + 2) & 3]);
+				tmp = _mm_add_epi32(tmp, _mm_alignr_epi8(w[i & 3], w[(i + 3) & 3], 4));
+				w[(i + 1) & 3] = _mm_sha256msg2_epu32(tmp, w[i & 3]);
+			}
+			msg = _mm_shuffle_epi32(msg, 0x0e);
+			state0 = _mm_sha256rnds2_epu32(state0, state1, msg);
+		}
+
+		state0 = _mm_add_epi32(state0, abef);
+		state1 = _mm_add_epi32(state1, cdgh);
+	}
+
+	store_state(state, state0, state1);
+}
+
+/*
+	Same as sha256_ni_blocks() but for two independent messages of nblocks blocks each
+	Each sha256rnds2 of one message is issued next to the other message's, so the second
+	hash runs in the latency shadow of the first instead of the pipeline sitting idle
+*/
+__attribute__((target("sha,sse4.1")))
+static void sha256_ni_blocks_x2(uint32_t state_a[8], const unsigned char *data_a,
+								uint32_t state_b[8], const unsigned char *data_b, size_t nblocks)
+{
+	const __m128i mask = _mm_set_epi64x(0x0c0d0e0f08090a0bULL, 0x0405060700010203ULL);
+	__m128i state0[2], state1[2], msg[2], tmp[2], abef[2], cdgh[2], k;
+	__m128i w[2][4];
+
+	load_state(state_a, &state0[0], &state1[0]);
+	load_state(state_b, &state0[1], &state1[1]);
+
+	for (; nblocks; nblocks--, data_a += 64, data_b += 64) {
+		for (int s = 0; s < 2; s++) {
+			abef[s] = state0[s];
+			cdgh[s] = state1[s];
+		}
+
+		for (int i = 0; i < 4; i++) {
+			w[0][i] = _mm_shuffle_epi8(_mm_loadu_si128((const __m128i *)(data_a + 16 * i)), mask);
+			w[1][i] = _mm_shuffle_epi8(_mm_loadu_si128((const __m128i *)(data_b + 16 * i)), mask);
+		}
+
+#pragma GCC unroll 16
+		for (int i = 0; i < 16; i++) {
+			k = _mm_loadu_si128((const __m128i *)&K[4 * i]);
+#pragma GCC unroll 2
+			for (int s = 0; s < 2; s++) {
+				msg[s] = _mm_add_epi32(w[s][i & 3], k);
+				state1[s] = _mm_sha256rnds2_epu32(state1[s], state0[s], msg[s]);
+			}
+			if (i >= 3 && i < 15) {
+#pragma GCC unroll 2
+				for (int s = 0; s < 2; s++) {
+					tmp[s] = _mm_sha256msg1_epu32(w[s][(i + 1) & 3], w[s][(i + 2) & 3]);
+					tmp[s] = _mm_add_epi32(tmp[s], _mm_alignr_epi8(w[s][i & 3], w[s][(i + 3) & 3], 4));
+					w[s][(i + 1) & 3] = _mm_sha256msg2_epu32(tmp[s], w[s][i & 3]);
+				}
+			}
+#pragma GCC unroll 2
+			for (int s = 0; s < 2; s++) {
+				msg[s] = _mm_shuffle_epi32(msg[s], 0x0e);
+				state0[s] = _mm_sha256rnds2_epu32(state0[s], state1[s], msg[s]);
+			}
+		}
+
+		for (int s = 0; s < 2; s++) {
+			state0[s] = _mm_add_epi32(state0[s], abef[s]);
+			state1[s] = _mm_add_epi32(state1[s], cdgh[s]);
+		}
+	}
+
+	store_state(state_a, state0[0], state1[0]);
+	store_state(state_b, state0[1], state1[1]);
+}
+
+/* A candidate nonce and its padded message */
+typedef struct {
+	unsigned char *msg;
+	uint64_t nonce;
+	size_t digits;
+	size_t nblocks;
+	uint32_t state[8];
+} candidate;
+
+/*
+	Sets the candidate to nonce and lays out its message
+*/
+static void candidate_init(candidate *c, uint64_t nonce, const layout *l)
+{
+	c->nonce = nonce;
+	c->nblocks = build_message(c->msg, l, nonce);
+	c->digits = format_nonce(nonce, (char *)c->msg + l->prefix_len);
+}
+
+/*
+	Moves the candidate step nonces ahead, only rebuilding the message when the nonce gains a digit
+*/
+static void candidate_advance(candidate *c, unsigned step, const layout *l)
+{
+	for (unsigned i = 0; i < step; i++) {
+		if (!increment_digits((char *)c->msg + l->prefix_len, c->digits)) {
+			candidate_init(c, c->nonce + step, l);
+			return;
+		}
+	}
+	c->nonce += step;
+}
+
+/*
+	Parameters -
+			prefix: Bytes placed before the nonce (the proof of the previous block)
+			suffix: Bytes placed after the nonce (the hash of the previous block)
+		difficulty: The number of leading hex zeros needed in the hash
+			 nonce: Receives the smallest nonce satisfying the difficulty
+
+	Tries the nonces two at a time (n, n + 1) with the interleaved SHA-NI compression
+
+	Returns -
+		0 if a nonce was found, -1 if the message buffers couldn't be allocated
+		and 1 if the 64 bit nonce space ran out without success
+*/
+static int find_nonce_sha_ni(const char *prefix, size_t prefix_len, const char *suffix, size_t suffix_len,
+							 unsigned difficulty, uint64_t *nonce)
+{
+	size_t msg_size = prefix_len % 64 + NONCE_MAX_DIGITS + suffix_len + 72;
+	unsigned char *buf = malloc(2 * msg_size);
+	candidate c[2];
+	layout l;
+	int status = 1;
+
+	if (buf == NULL)
+		return -1;
+
+	layout_init(&l, prefix, prefix_len, suffix, suffix_len);
+
+	for (int s = 0; s < 2; s++) {
+		c[s].msg = buf + s * msg_size;
+		candidate_init(&c[s], s, &l);
+	}
+
+	while (c[1].nonce < UINT64_MAX - 1) {
+		for (int s = 0; s < 2; s++)
+			memcpy(c[s].state, l.midstate, sizeof(l.midstate));
+
+		/* The pair only differs in length when n + 1 gains a digit */
+		if (c[0].nblocks == c[1].nblocks) {
+			sha256_ni_blocks_x2(c[0].state, c[0].msg, c[1].state, c[1].msg, c[0].nblocks);
+		} else {
+			sha256_ni_blocks(c[0].state, c[0].msg, c[0].nblocks);
+			sha256_ni_blocks(c[1].state, c[1].msg, c[1].nblocks);
+		}
+
+		/* Checked in order so the smaller nonce wins */
+		for (int s = 0; s < 2; s++) {
+			if (has_leading_zeros(c[s].state, difficulty)) {
+				*nonce = c[s].nonce;
+				status = 0;
+				goto done;
+			}
+		}
+
+		for (int s = 0; s < 2; s++)
+			candidate_advance(&c[s], 2, &l);
+	}
+
+done:
+	free(buf);
+	return status;
+}
+
+#define ROR256(x, n) _mm256_or_si256(_mm256_srli_epi32(x, n), _mm256_slli_epi32(x, 32 - (n)))
+
+/*
+	Loads big endian word t of each of the eight messages into one vector, lane i from msg[i]
+*/
+__attribute__((target("avx2")))
+static inline __m256i load_words_x8(const unsigned char *const msg[8], size_t offset)
+{
+	uint32_t w[8];
+
+	for (int i = 0; i < 8; i++) {
+		memcpy(&w[i], msg[i] + offset, sizeof(uint32_t));
+		w[i] = __builtin_bswap32(w[i]);
+	}
+	return _mm256_loadu_si256((const __m256i *)w);
+}
+
+/*
+	Runs the SHA-256 compression over nblocks blocks of eight messages at once
+	state[i] holds word i of all eight hashes, one per 32 bit lane
+*/
+__attribute__((target("avx2")))
+static void sha256_avx2_blocks_x8(__m256i state[8], const unsigned char *const msg[8], size_t nblocks)
+{
+	__m256i w[64], v[8], t1, t2;
+
+	for (size_t blk = 0; blk < nblocks; blk++) {
+		for (int t = 0; t < 16; t++)
+			w[t] = load_words_x8(msg, 64 * blk + 4 * t);
+		for (int t = 16; t < 64; t++) {
+			t1 = _mm256_xor_si256(_mm256_xor_si256(ROR256(w[t - 2], 17), ROR256(w[t - 2], 19)),
+								  _mm256_srli_epi32(w[t - 2], 10));
+			t2 = _mm256_xor_si256(_mm256_xor_si256(ROR256(w[t - 15], 7), ROR256(w[t - 15], 18)),
+								  _mm256_srli_epi32(w[t - 15], 3));
+			w[t] = _mm256_add_epi32(_mm256_add_epi32(t1, w[t - 7]), _mm256_add_epi32(t2, w[t - 16]));
+		}
+
+		for (int i = 0; i < 8; i++)
+			v[i] = state[i];
+
+#pragma GCC unroll 8
+		for (int t = 0; t < 64; t++) {
+			/* t1 = h + S1(e) + Ch(e, f, g) + K[t] + W[t] */
+			t1 = _mm256_xor_si256(_mm256_xor_si256(ROR256(v[4], 6), ROR256(v[4], 11)), ROR256(v[4], 25));
+			t1 = _mm256_add_epi32(t1, _mm256_xor_si256(_mm256_and_si256(v[4], v[5]), _mm256_andnot_si256(v[4], v[6])));
+			t1 = _mm256_add_epi32(_mm256_add_epi32(t1, v[7]),
+								  _mm256_add_epi32(w[t], _mm256_set1_epi32((int)K[t])));
+			/* t2 = S0(a) + Maj(a, b, c) */
+			t2 = _mm256_xor_si256(_mm256_xor_si256(ROR256(v[0], 2), ROR256(v[0], 13)), ROR256(v[0], 22));
+			t2 = _mm256_add_epi32(t2, _mm256_or_si256(_mm256_and_si256(v[0], v[1]),
+													  _mm256_and_si256(v[2], _mm256_or_si256(v[0], v[1]))));
+			v[7] = v[6];
+			v[6] = v[5];
+			v[5] = v[4];
+			v[4] = _mm256_add_epi32(v[3], t1);
+			v[3] = v[2];
+			v[2] = v[1];
+			v[1] = v[0];
+			v[0] = _mm256_add_epi32(t1, t2);
+		}
+
+		for (int i = 0; i < 8; i++)
+			state[i] = _mm256_add_epi32(state[i], v[i]);
+	}
+}
+
+/*
+	Same contract as find_nonce_sha_ni() but tries eight nonces (n .. n + 7) per
+	iteration with the AVX2 compression, for CPUs without the SHA extensions
+*/
+__attribute__((target("avx2")))
+static int find_nonce_avx2(const char *prefix, size_t prefix_len, const char *suffix, size_t suffix_len,
+						   unsigned difficulty, uint64_t *nonce)
+{
+	size_t msg_size = prefix_len % 64 + NONCE_MAX_DIGITS + suffix_len + 72;
+	unsigned char *buf = malloc(8 * msg_size);
+	const unsigned char *msg[8];
+	uint32_t words[8][8];
+	__m256i state[8], h0;
+	candidate c[8];
+	layout l;
+	unsigned hits;
+	int status = 1;
+
+	if (buf == NULL)
+		return -1;
+
+	layout_init(&l, prefix, prefix_len, suffix, suffix_len);
+
+	for (int s = 0; s < 8; s++) {
+		c[s].msg = buf + s * msg_size;
+		candidate_init(&c[s], s, &l);
+		msg[s] = c[s].msg;
+	}
+
+	while (c[7].nonce < UINT64_MAX - 7) {
+		int same_length = 1;
+
+		for (int s = 1; s < 8; s++)
+			same_length &= c[s].nblocks == c[0].nblocks;
+
+		if (same_length) {
+			for (int i = 0; i < 8; i++)
+				state[i] = _mm256_set1_epi32((int)l.midstate[i]);
+			sha256_avx2_blocks_x8(state, msg, c[0].nblocks);
+
+			/* Cheap filter on H0 of every lane, the full check only runs on the rare hit */
+			h0 = difficulty >= 8 ? state[0] : _mm256_srli_epi32(state[0], 32 - 4 * difficulty);
+			hits = difficulty ? (unsigned)_mm256_movemask_ps(
+				_mm256_castsi256_ps(_mm256_cmpeq_epi32(h0, _mm256_setzero_si256()))) : 0xff;
+
+			if (hits) {
+				for (int i = 0; i < 8; i++)
+					_mm256_storeu_si256((__m256i *)words[i], state[i]);
+				for (; hits; hits &= hits - 1) {
+					int s = __builtin_ctz(hits);
+
+					for (int i = 0; i < 8; i++)
+						c[s].state[i] = words[i][s];
+					if (has_leading_zeros(c[s].state, difficulty)) {
+						*nonce = c[s].nonce;
+						status = 0;
+						goto done;
+					}
+				}
+			}
+		} else {
+			for (int s = 0; s < 8; s++) {
+				memcpy(c[s].state, l.midstate, sizeof(l.midstate));
+				sha256_blocks(c[s].state, c[s].msg, c[s].nblocks);
+				if (has_leading_zeros(c[s].state, difficulty)) {
+					*nonce = c[s].nonce;
+					status = 0;
+					goto done;
+				}
+			}
+		}
+
+		for (int s = 0; s < 8; s++)
+			candidate_advance(&c[s], 8, &l);
+	}
+
+done:
+	free(buf);
+	return status;
+}
+
+/* Picked in PyInit_pow_sha_ni() from what the CPU supports */
+static int (*find_nonce)(const char *, size_t, const char *, size_t, unsigned, uint64_t *);
+
+#endif /* POW_X86 */
+
+static PyObject *py_find_nonce(PyObject *self, PyObject *args)
+{
+	const char *prefix, *suffix;
+	Py_ssize_t prefix_len, suffix_len;
+	unsigned int difficulty;
+	uint64_t nonce = 0;
+	int status = 1;
+
+	if (!PyArg_ParseTuple(args, "y#y#I:find_nonce", &prefix, &prefix_len, &suffix, &suffix_len, &difficulty))
+		return NULL;
+
+	if (difficulty > 64) {
+		PyErr_SetString(PyExc_ValueError, "difficulty can be at most 64 hex digits");
+		return NULL;
+	}
+
+#ifdef POW_X86
+	Py_BEGIN_ALLOW_THREADS
+	status = find_nonce(prefix, (size_t)prefix_len, suffix, (size_t)suffix_len, difficulty, &nonce);
+	Py_END_ALLOW_THREADS
+#endif
+
+	if (status < 0)
+		return PyErr_NoMemory();
+	if (status > 0) {
+		PyErr_SetString(PyExc_RuntimeError, "No nonce satisfies the difficulty");
+		return NULL;
+	}
+
+	return PyLong_FromUnsignedLongLong(nonce);
+}
+
+static PyMethodDef pow_methods[] = {
+	{"find_nonce", py_find_nonce, METH_VARARGS,
+	 "find_nonce(prefix, suffix, difficulty)\n\n"
+	 "Returns the smallest nonce for which sha256(prefix + str(nonce) + suffix)\n"
+	 "begins with difficulty hex zeros"},
+	{NULL, NULL, 0, NULL}
+};
+
+static struct PyModuleDef pow_module = {
+	PyModuleDef_HEAD_INIT, "pow_sha_ni", "SHA-NI / AVX2 accelerated Proof of Work", -1, pow_methods
+};
+
+PyMODINIT_FUNC PyInit_pow_sha_ni(void)
+{
+#ifdef POW_X86
+	__builtin_cpu_init();
+	if (__builtin_cpu_supports("sha"))
+		find_nonce = find_nonce_sha_ni;
+	else if (__builtin_cpu_supports("avx2"))
+		find_nonce = find_nonce_avx2;
+	if (find_nonce)
+		return PyModule_Create(&pow_module);
+#endif
+
+	/* Lets blockchain.py fall back to hashlib */
+	PyErr_SetString(PyExc_ImportError, "CPU supports neither the SHA extensions nor AVX2");
+	return NULL;
+}
@@ -0,0 +1,11 @@
+from setuptools import setup, Extension
+
+# The SHA-NI and AVX2 code paths are enabled per function with target attributes and picked at import
+# time, so no -msha/-mavx2 here, the module still builds (and falls back) on older CPUs
+setup(
+	name='blockchain',
+	py_modules=['blockchain'],
+	ext_modules=[
+		Extension('pow_sha_ni', sources=['pow_sha_ni.c'], extra_compile_args=['-O3'])
+	]
+)
@@ -0,0 +1,201 @@
+'''
+	Checks the block hashing and the consensus of the Blockchain class
+
+	Run with python -m unittest
+'''
+import copy
+import multiprocessing
+import unittest
+from unittest import mock
+
+import requests
+
+import blockchain
+from blockchain import Blockchain
+
+def mine(node, blocks):
+	'''
+		Adds blocks blocks with one transaction each to the chain of node
+	'''
+	for i in range(blocks):
+		last_block = node.last_block
+		proof = node.proof_of_work(last_block)
+		node.new_transaction('0', 'miner', i)
+		node.add_block(proof, node.hash(last_block))
+
+class MerkleRootTest(unittest.TestCase):
+	def setUp(self):
+		self.transactions = [{'sender': 'a', 'recipient': 'b', 'amount': i} for i in range(7)]
+
+	def test_repeated_last_transaction(self):
+		for count in range(1, len(self.transactions) + 1):
+			transactions = self.transactions[:count]
+			with self.subTest(count=count):
+				self.assertNotEqual(
+					Blockchain.merkle_root(transactions),
+					Blockchain.merkle_root(transactions + transactions[-1:])
+				)
+
+	def test_repeated_last_transaction_changes_block_hash(self):
+		block = {
+			'index': 2,
+			'timestamp': 1.0,
+			'transactions': self.transactions[:3],
+			'proof': 35293,
+			'previous_hash': 'abc'
+		}
+		repeated = copy.deepcopy(block)
+		repeated['transactions'].append(repeated['transactions'][-1])
+		self.assertNotEqual(Blockchain.hash(block), Blockchain.hash(repeated))
+
+	def test_no_transactions(self):
+		self.assertEqual(Blockchain.merkle_root([]), bytes(32))
+
+class ProofOfWorkTest(unittest.TestCase):
+	def setUp(self):
+		self.node = Blockchain()
+		self.last_proof = self.node.last_block['proof']
+		self.last_hash = self.node.hash(self.node.last_block)
+
+	def test_search_nonces_matches_validate(self):
+		for difficulty in (1, 2, 3):
+			for stride in (1, 2, 3, 7):
+				for start in (0, stride - 1, 995, 1000 + stride):
+					with self.subTest(difficulty=difficulty, stride=stride, start=start):
+						proof = Blockchain.search_nonces(start, stride, self.last_proof, self.last_hash, difficulty)
+						self.assertTrue(Blockchain.validate(self.last_proof, proof, self.last_hash, difficulty))
+						self.assertEqual((proof - start) % stride, 0)
+						for smaller in range(start, proof, stride):
+							self.assertFalse(Blockchain.validate(self.last_proof, smaller, self.last_hash, difficulty))
+
+	def test_search_processes(self):
+		with mock.patch.object(blockchain, 'find_nonce', None), \
+				mock.patch.object(blockchain.os, 'cpu_count', return_value=3):
+			proof = self.node.proof_of_work(self.node.last_block, difficulty=3)
+		self.assertTrue(Blockchain.validate(self.last_proof, proof, self.last_hash, difficulty=3))
+
+	def test_search_processes_died(self):
+		# The processes are mocks which never run, so none of them publishes a proof
+		context = mock.Mock(Value=multiprocessing.Value)
+		with mock.patch.object(blockchain, 'find_nonce', None), \
+				mock.patch.object(blockchain.os, 'cpu_count', return_value=3), \
+				mock.patch.object(blockchain.multiprocessing, 'get_context', return_value=context):
+			proof = self.node.proof_of_work(self.node.last_block, difficulty=3)
+		self.assertTrue(Blockchain.validate(self.last_proof, proof, self.last_hash, difficulty=3))
+
+class ResolveConflictsTest(unittest.TestCase):
+	'''
+		The chains of the peers are served by a mocked session, peer is 4 blocks long and the node 3
+	'''
+	def setUp(self):
+		self.peer = Blockchain()
+		mine(self.peer, 3)
+		self.node = Blockchain()
+		self.node.chain = self.peer_chain()[:3]
+		self.replies = {}
+
+		patcher = mock.patch.object(blockchain, 'session')
+		self.addCleanup(patcher.stop)
+		patcher.start().get.side_effect = self.get
+
+	def peer_chain(self):
+		return copy.deepcopy(Blockchain.export_chain(self.peer.chain))
+
+	def get(self, url, timeout):
+		reply = self.replies[url.split('/')[2]]
+		if isinstance(reply, requests.exceptions.RequestException):
+			raise reply
+
+		response = mock.Mock(status_code=200)
+		if isinstance(reply, int):
+			response.status_code = reply
+		elif isinstance(reply, Exception):
+			response.json.side_effect = reply
+		else:
+			response.json.return_value = copy.deepcopy(reply)
+		return response
+
+	def resolve(self, **replies):
+		self.replies = replies
+		for node in replies:
+			self.node.register_node('http://' + node)
+		return self.node.resolve_conflicts()
+
+	def test_common_prefix(self):
+		self.assertEqual(self.node.common_prefix(self.peer_chain()), 3)
+		chain = self.peer_chain()
+		chain[1]['proof'] += 1
+		self.assertEqual(self.node.common_prefix(chain), 1)
+		self.assertEqual(self.node.common_prefix([]), 0)
+
+	def test_one_block_extension(self):
+		self.assertTrue(self.resolve(peer={'length': 4, 'chain': self.peer_chain()}))
+		self.assertEqual(Blockchain.export_chain(self.node.chain), self.peer_chain())
+
+	def test_tampered_tail(self):
+		# The last block holds the hash of the tampered one before it
+		chain = self.peer_chain()
+		chain[-2]['transactions'][0]['amount'] = 1000
+		self.assertFalse(self.resolve(peer={'length': 4, 'chain': chain}))
+		self.assertEqual(len(self.node.chain), 3)
+
+	def test_malformed_replies(self):
+		chain = self.peer_chain()
+		malformed = {
+			'no-chain': {'length': 4},
+			'empty': {'length': 5, 'chain': []},
+			'claims-length': {'length': 5, 'chain': chain[:2]},
+			'not-a-list': {'length': 4, 'chain': 5},
+			'not-a-block': {'length': 4, 'chain': chain[:3] + ['block']},
+			'not-json': ValueError('not json'),
+			'unreachable': requests.exceptions.ConnectionError('down'),
+			'server-error': 500
+		}
+		for field, value in [
+			('junk', 2 ** 70), ('proof', -1), ('proof', 1.5), ('index', -1),
+			('timestamp', 'now'), ('previous_hash', 'a' * 70000), ('transactions', 5)
+		]:
+			tampered = copy.deepcopy(chain)
+			tampered[-1][field] = value
+			malformed[f'{field}-{value}'[:32]] = {'length': 4, 'chain': tampered}
+		missing = copy.deepcopy(chain)
+		del missing[-1]['proof']
+		malformed['missing-proof'] = {'length': 4, 'chain': missing}
+
+		for node, reply in malformed.items():
+			with self.subTest(node=node):
+				self.assertFalse(self.resolve(**{node: reply}))
+				self.assertEqual(len(self.node.chain), 3)
+			self.node.nodes.clear()
+
+		# The valid chain of another peer is still adopted next to all of them
+		self.assertTrue(self.resolve(peer={'length': 4, 'chain': chain}, **malformed))
+		self.assertEqual(Blockchain.export_chain(self.node.chain), chain)
+
+class NewTransactionTest(unittest.TestCase):
+	def setUp(self):
+		self.client = blockchain.app.test_client()
+		patcher = mock.patch.object(blockchain, 'blockchain', Blockchain())
+		self.addCleanup(patcher.stop)
+		self.node = patcher.start()
+
+	def test_amount_out_of_range(self):
+		for amount in (2 ** 64, 2 ** 70, -2 ** 63 - 1, [2 ** 70]):
+			with self.subTest(amount=amount):
+				response = self.client.post('/transactions/new', json={'sender': 'a', 'recipient': 'b', 'amount': amount})
+				self.assertEqual(response.status_code, 400)
+		self.assertEqual(self.node.current_transactions, [])
+
+		# The node still mines and serves its chain afterwards
+		self.assertEqual(self.client.get('/mine').status_code, 200)
+		response = self.client.get('/chain')
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(response.get_json()['length'], 2)
+
+	def test_amount_in_range(self):
+		response = self.client.post('/transactions/new', json={'sender': 'a', 'recipient': 'b', 'amount': 2 ** 63 - 1})
+		self.assertEqual(response.status_code, 201)
+		self.assertEqual(len(self.node.current_transactions), 1)
+
+if __name__ == '__main__':
+	unittest.main()
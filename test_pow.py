@@ -0,0 +1,66 @@
+'''
+	Checks each nonce search backend against a brute force search with hashlib
+
+	Run with python -m unittest (after python setup.py build_ext --inplace for pow_sha_ni)
+'''
+import importlib
+import unittest
+from hashlib import sha256
+
+def brute_force(prefix, suffix, difficulty):
+	'''
+		Returns -
+			The smallest nonce for which sha256(prefix + str(nonce) + suffix) begins with difficulty hex zeros
+	'''
+	nonce = 0
+	while not sha256(prefix + b'%d' % nonce + suffix).hexdigest().startswith('0' * difficulty):
+		nonce += 1
+
+	return nonce
+
+def cases():
+	'''
+		Returns -
+			(prefix, suffix, difficulty) triples whose messages end on either side of the 55 and 64 byte
+			padding boundaries of the first and second block, with nonces of one to four digits
+	'''
+	suffix = sha256(b'suffix').hexdigest().encode()
+	for length in list(range(0, 12)) + list(range(40, 72)) + list(range(100, 130)):
+		for difficulty in (0, 1, 2):
+			# The hex hash of the previous block as in proof_of_work, and an arbitrary suffix of the length
+			yield b'7' * (length % 20), suffix[:max(length - 20, 0)], difficulty
+			yield b'%d' % length, b'x' * length, difficulty
+
+	# Searches which go past 9, 99 and 999, so the nonce gains a digit during the search
+	for last_proof in range(40):
+		yield b'%d' % last_proof, suffix, 3
+
+class FindNonceTest:
+	'''
+		Mixed into one unittest.TestCase per backend, backend is the name of its module
+	'''
+	backend = None
+
+	def setUp(self):
+		try:
+			self.find_nonce = importlib.import_module(self.backend).find_nonce
+		except ImportError as e:
+			self.skipTest(f'{self.backend} unavailable: {e}')
+
+	def test_matches_brute_force(self):
+		for prefix, suffix, difficulty in cases():
+			with self.subTest(prefix=prefix, suffix=suffix, difficulty=difficulty):
+				self.assertEqual(self.find_nonce(prefix, suffix, difficulty), brute_force(prefix, suffix, difficulty))
+
+	def test_nonce_gains_digits(self):
+		nonces = [self.find_nonce(prefix, suffix, difficulty) for prefix, suffix, difficulty in cases()]
+		self.assertGreaterEqual(max(nonces), 1000)
+
+class SHANITest(FindNonceTest, unittest.TestCase):
+	backend = 'pow_sha_ni'
+
+class NumbaTest(FindNonceTest, unittest.TestCase):
+	backend = 'pow_numba'
+
+if __name__ == '__main__':
+	unittest.main()